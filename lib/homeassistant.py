@@ -19,22 +19,238 @@ Configuration example:
 #################################################################################
 
 import logging
-import json
+import os
+import hashlib
 import time
 import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from lib.PluginSuperClass import PluginSuperClass
 import globalState
 
 try:
     import paho.mqtt.client as mqtt
+    from paho.mqtt.properties import Properties
+    from paho.mqtt.packettypes import PacketTypes
     MQTT_AVAILABLE = True
 except ImportError:
     MQTT_AVAILABLE = False
     logging.getLogger(__name__).warning("paho-mqtt not available - Home Assistant integration disabled")
 
+# orjson is considerably faster than the stdlib json module; both paths produce bytes,
+# which paho will publish as-is
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    import json
+    _dumps = lambda o: json.dumps(o).encode()
+
 # logging for use in this module
 _LOGGER = logging.getLogger(__name__)
 
+# Sentinel for state values that have not been published yet
+_MISSING = object()
+
+# How long to wait for the "offline" availability message to be delivered on shutdown (seconds)
+_SHUTDOWN_PUBLISH_TIMEOUT = 2
+
+def _shutdown_mqtt(client, pool, availability_topic):
+    """Disconnect an MQTT client and stop its network thread (weakref finalizer, so must not reference the plugin)"""
+    try:
+        # A clean disconnect means the broker won't send our will, so mark ourselves offline first
+        info = client.publish(availability_topic, b"offline", qos=1, retain=True)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            info.wait_for_publish(timeout=_SHUTDOWN_PUBLISH_TIMEOUT)
+    except Exception as e:
+        _LOGGER.warning(f"Unable to publish offline availability: {e}")
+    try:
+        client.disconnect()
+        client.loop_stop()
+    except Exception as e:
+        _LOGGER.warning(f"Error shutting down MQTT client: {e}")
+    pool.shutdown(wait=False)
+
+#################################################################################
+# Entities published to Home Assistant via auto-discovery. "{device_id}" in string values is
+# substituted when the discovery messages are built, and "max" is capped to the current limit.
+_DISCOVERY_ENTITIES = (
+    # Sensors
+    {
+        "component": "sensor",
+        "object_id": "charger_state",
+        "name": "Charger State",
+        "state_topic": "openeo/{device_id}/state/charger_state",
+        "icon": "mdi:ev-station"
+    },
+    {
+        "component": "sensor",
+        "object_id": "amps_requested",
+        "name": "Amps Requested",
+        "state_topic": "openeo/{device_id}/state/amps_requested",
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:current-ac"
+    },
+    {
+        "component": "sensor",
+        "object_id": "amps_limit",
+        "name": "Amps Limit",
+        "state_topic": "openeo/{device_id}/state/amps_limit",
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:current-ac"
+    },
+    {
+        "component": "sensor",
+        "object_id": "power_delivered",
+        "name": "Power Delivered",
+        "state_topic": "openeo/{device_id}/state/power_delivered",
+        "unit_of_measurement": "kW",
+        "device_class": "power",
+        "icon": "mdi:flash"
+    },
+    {
+        "component": "sensor",
+        "object_id": "power_requested",
+        "name": "Power Requested",
+        "state_topic": "openeo/{device_id}/state/power_requested",
+        "unit_of_measurement": "kW",
+        "device_class": "power",
+        "icon": "mdi:flash-outline"
+    },
+    {
+        "component": "sensor",
+        "object_id": "voltage",
+        "name": "Voltage",
+        "state_topic": "openeo/{device_id}/state/voltage",
+        "unit_of_measurement": "V",
+        "device_class": "voltage",
+        "icon": "mdi:lightning-bolt"
+    },
+    {
+        "component": "sensor",
+        "object_id": "frequency",
+        "name": "Mains Frequency",
+        "state_topic": "openeo/{device_id}/state/frequency",
+        "unit_of_measurement": "Hz",
+        "device_class": "frequency",
+        "icon": "mdi:sine-wave"
+    },
+    {
+        "component": "sensor",
+        "object_id": "current_site",
+        "name": "Site Current",
+        "state_topic": "openeo/{device_id}/state/current_site",
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:home-lightning-bolt"
+    },
+    {
+        "component": "sensor",
+        "object_id": "current_vehicle",
+        "name": "Vehicle Current",
+        "state_topic": "openeo/{device_id}/state/current_vehicle",
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:car-electric"
+    },
+    {
+        "component": "sensor",
+        "object_id": "current_solar",
+        "name": "Solar Current",
+        "state_topic": "openeo/{device_id}/state/current_solar",
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:solar-power"
+    },
+    {
+        "component": "binary_sensor",
+        "object_id": "vehicle_connected",
+        "name": "Vehicle Connected",
+        "state_topic": "openeo/{device_id}/state/vehicle_connected",
+        "payload_on": "true",
+        "payload_off": "false",
+        "device_class": "connectivity",
+        "icon": "mdi:car-connected"
+    },
+    {
+        "component": "binary_sensor",
+        "object_id": "charging_active",
+        "name": "Charging Active",
+        "state_topic": "openeo/{device_id}/state/charging_active",
+        "payload_on": "true",
+        "payload_off": "false",
+        "device_class": "battery_charging",
+        "icon": "mdi:battery-charging"
+    },
+    # Controls
+    {
+        "component": "switch",
+        "object_id": "charger_switch",
+        "name": "Charger Switch",
+        "state_topic": "openeo/{device_id}/state/switch",
+        "command_topic": "openeo/{device_id}/command/switch/set",
+        "payload_on": "ON",
+        "payload_off": "OFF",
+        "icon": "mdi:ev-station",
+        "device_class": "switch"
+    },
+    {
+        "component": "number",
+        "object_id": "current_limit",
+        "name": "Current Limit",
+        "state_topic": "openeo/{device_id}/state/current_limit_setting",
+        "command_topic": "openeo/{device_id}/command/current_limit/set",
+        "min": globalState.MIN_CHARGING_CURRENT,
+        "max": globalState.MAX_CHARGING_CURRENT,
+        "step": 1,
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:current-ac"
+    },
+    {
+        "component": "select",
+        "object_id": "charger_mode",
+        "name": "Charger Mode",
+        "state_topic": "openeo/{device_id}/state/mode",
+        "command_topic": "openeo/{device_id}/command/mode/set",
+        "options": ["manual", "schedule", "off"],
+        "icon": "mdi:cog"
+    },
+    {
+        "component": "time",
+        "object_id": "schedule_start",
+        "name": "Schedule Start Time",
+        "state_topic": "openeo/{device_id}/state/schedule_start",
+        "command_topic": "openeo/{device_id}/command/schedule_start/set",
+        "value_template": "{{ value[:2] + ':' + value[2:] if value|length == 4 else '22:00' }}",
+        "icon": "mdi:clock-start"
+    },
+    {
+        "component": "time",
+        "object_id": "schedule_end",
+        "name": "Schedule End Time",
+        "state_topic": "openeo/{device_id}/state/schedule_end",
+        "command_topic": "openeo/{device_id}/command/schedule_end/set",
+        "value_template": "{{ value[:2] + ':' + value[2:] if value|length == 4 else '06:00' }}",
+        "icon": "mdi:clock-end"
+    },
+    {
+        "component": "number",
+        "object_id": "schedule_amps",
+        "name": "Schedule Current Limit",
+        "state_topic": "openeo/{device_id}/state/schedule_amps",
+        "command_topic": "openeo/{device_id}/command/schedule_amps/set",
+        "min": globalState.MIN_CHARGING_CURRENT,
+        "max": globalState.MAX_CHARGING_CURRENT,
+        "step": 1,
+        "unit_of_measurement": "A",
+        "device_class": "current",
+        "icon": "mdi:current-ac"
+    }
+)
+
 #################################################################################
 class homeassistantClassPlugin(PluginSuperClass):
     PRETTY_NAME = "Home Assistant MQTT"
@@ -52,24 +268,122 @@ class homeassistantClassPlugin(PluginSuperClass):
         "publish_interval": {"type": "int", "default": 5}
     }
     
+    # State payload fields that are copied directly from globalState.stateDict,
+    # as (payload key, stateDict key, default)
+    _STATE_MAP = (
+        ("charger_state", "eo_charger_state", ""),
+        ("amps_requested", "eo_amps_requested", 0),
+        ("amps_limit", "eo_amps_limit", 0),
+        ("power_delivered", "eo_power_delivered", 0),
+        ("power_requested", "eo_power_requested", 0),
+        ("voltage", "eo_live_voltage", 0),
+        ("frequency", "eo_mains_frequency", 0),
+        ("current_site", "eo_current_site", 0),
+        ("current_vehicle", "eo_current_vehicle", 0),
+        ("current_solar", "eo_current_solar", 0)
+    )
+    
+    # Charger state ids (see CHARGER_STATES in openeoCharger.py) as bitmasks. A vehicle is connected
+    # if a plug is present, the car is connected or it is charging; charging is active in the
+    # charging and charge-complete states.
+    _VEHICLE_CONNECTED_MASK = sum(1 << i for i in (7, 8, 9, 10, 11, 12, 13, 14, 15, 16))
+    _CHARGING_ACTIVE_MASK = sum(1 << i for i in (11, 12, 13, 14))
+    
+    # Command payload vocabularies. Handlers work on the raw bytes payload to avoid decoding every message
+    _TRUE_PAYLOADS = frozenset((b"ON", b"TRUE", b"1"))
+    _PLUGIN_ENABLE_PAYLOADS = frozenset((b"true", b"on", b"1", b"enabled"))
+    _REMOTE_PLUGINS = frozenset((b"scheduler", b"switch", b"loadmanagement"))
+    
+    # How long (seconds) the broker should keep our session and subscriptions after a disconnect
+    SESSION_EXPIRY_INTERVAL = 3600
+    
+    # Unchanged state values are still republished at least this often (seconds)
+    HEARTBEAT_INTERVAL = 60
+    
     def __init__(self, configParam):
         self.mqtt_client = None
+        self._finalizer = None
+        self._device_id = None
         self.connected = False
-        self.last_publish = 0
-        self.discovery_sent = False
+        # Monotonic timestamp of the last state publish; -inf so the first poll always publishes
+        self.last_publish = float("-inf")
+        self._discovery_cache = None
+        self._command_handlers = {}
+        self._subscribed = False
+        self._last_state = {}
+        # (connection generation, MQTTMessageInfo) of the last state packet queued
+        self._last_state_info = None
+        self._connection_generation = 0
+        self._last_heartbeat = float("-inf")
+        # Single reusable worker for discovery. The lock guards the running/rerun flags, so that
+        # only one run is in flight at a time and no rerun request is lost.
+        self._discovery_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ha_discovery")
+        self._discovery_lock = threading.Lock()
+        self._discovery_running = False
+        self._discovery_rerun = False
+        # Hash of the discovery messages last sent to the broker, persisted so that a restart
+        # doesn't need to resend the (retained) discovery messages either
+        self._discovery_hash_file = os.path.join(os.path.dirname(globalState.configDB.DB_FILE), "homeassistant_discovery.hash")
+        self._last_sent_hash = self._load_discovery_hash()
+        # Bumped whenever _last_sent_hash is invalidated, so that a discovery run that started
+        # before the invalidation can't record its hash afterwards
+        self._discovery_hash_lock = threading.Lock()
+        self._discovery_hash_generation = 0
         super().__init__(configParam)
         
         if not MQTT_AVAILABLE:
             _LOGGER.error("paho-mqtt library not available - install with: pip install paho-mqtt")
             return
             
-        if self.get_config("enabled"):
+        if self._enabled:
             self._setup_mqtt()
     
+    def configure(self, configParam):
+        super().configure(configParam)
+        self._refresh_config()
+    
+    def _refresh_config(self):
+        """Snapshot config values used on every poll, so they aren't looked up each cycle"""
+        self._enabled = self.pluginConfig["enabled"]
+        self._publish_interval = self.pluginConfig["publish_interval"]
+        
+        # The client id, will and shutdown availability topic are fixed when the client is created
+        if self.mqtt_client and self.pluginConfig["device_id"] != self._device_id:
+            _LOGGER.warning(f"Home Assistant device_id changed from '{self._device_id}' to '{self.pluginConfig['device_id']}' - "
+                            "restart openeo to update the MQTT client id and availability topic")
+        self._device_id = self.pluginConfig["device_id"]
+        self._discovery_prefix = self.pluginConfig["mqtt_discovery_prefix"]
+        self._state_topic = f"openeo/{self._device_id}/state"
+        self._availability_topic = f"openeo/{self._device_id}/availability"
+        
+        # Map each command topic to its handler, so that _on_message is a single lookup
+        previous_handlers = self._command_handlers
+        command_base = f"openeo/{self._device_id}/command"
+        self._command_handlers = {
+            f"{command_base}/switch/set": self._handle_switch_command,
+            f"{command_base}/current_limit/set": self._handle_current_limit_command,
+            f"{command_base}/mode/set": self._handle_mode_command,
+            f"{command_base}/enable_plugin/set": self._handle_enable_plugin_command,
+            f"{command_base}/schedule_start/set": self._handle_schedule_start_command,
+            f"{command_base}/schedule_end/set": self._handle_schedule_end_command,
+            f"{command_base}/schedule_amps/set": self._handle_schedule_amps_command
+        }
+        
+        # A resumed broker session only holds subscriptions for the old topics
+        if self._command_handlers.keys() != previous_handlers.keys():
+            self._subscribed = False
+    
     def _setup_mqtt(self):
         """Initialize MQTT client and connect to broker"""
         try:
-            self.mqtt_client = mqtt.Client()
+            # MQTT v5 with a persistent session, so the broker keeps our subscriptions across reconnects
+            self.mqtt_client = mqtt.Client(client_id=self._device_id, protocol=mqtt.MQTTv5)
+            self.mqtt_client.reconnect_delay_set(min_delay=1, max_delay=60)
+            # Bound paho's queue of unacknowledged QoS>0 messages (discovery and availability). It must
+            # still hold a full burst of discovery messages. QoS 0 state publishes aren't covered by
+            # this limit - _publish_state bounds those itself.
+            self.mqtt_client.max_queued_messages_set(len(_DISCOVERY_ENTITIES) + 10)
+            self.mqtt_client.max_inflight_messages_set(20)
             
             # Set authentication if provided
             username = self.get_config("mqtt_username")
@@ -86,29 +400,57 @@ class homeassistantClassPlugin(PluginSuperClass):
             host = self.get_config("mqtt_host")
             port = self.get_config("mqtt_port")
             
+            # Have the broker mark us as unavailable if we drop off without disconnecting
+            self.mqtt_client.will_set(self._availability_topic, b"offline", retain=True)
+            
             _LOGGER.info(f"Connecting to MQTT broker at {host}:{port}")
-            self.mqtt_client.connect_async(host, port, 60)
+            connect_properties = Properties(PacketTypes.CONNECT)
+            connect_properties.SessionExpiryInterval = self.SESSION_EXPIRY_INTERVAL
+            self.mqtt_client.connect_async(host, port, 60, clean_start=False, properties=connect_properties)
             self.mqtt_client.loop_start()
             
+            # Shut the client down on close() or at interpreter exit. The client's callbacks hold
+            # references to this plugin, so it won't be garbage collected while the client exists.
+            self._finalizer = weakref.finalize(self, _shutdown_mqtt, self.mqtt_client, self._discovery_pool,
+                                              self._availability_topic)
+            
         except Exception as e:
             _LOGGER.error(f"Failed to setup MQTT connection: {e}")
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for MQTT connection"""
         if rc == 0:
             self.connected = True
             _LOGGER.info("Connected to MQTT broker")
-            # Subscribe to command topics
-            self._subscribe_to_commands()
+            # paho has dropped any packets queued on the old connection, so a state packet from it
+            # will never be published. Bumping the generation also covers one recorded after this point.
+            self._connection_generation += 1
+            self._last_state_info = None
+            self._last_state = {}
+            self.mqtt_client.publish(self._availability_topic, b"online", qos=1, retain=True)
+            
+            session_present = flags.get("session present")
+            if not session_present:
+                # The broker has no record of us (e.g. it has restarted), so it may
+                # have lost the retained discovery messages too
+                with self._discovery_hash_lock:
+                    self._last_sent_hash = None
+                    self._discovery_hash_generation += 1
+            
+            # Subscribe to command topics, unless the broker has resumed our previous session
+            if not (self._subscribed and session_present):
+                self._subscribe_to_commands()
             # Send discovery messages after connection
-            threading.Thread(target=self._send_discovery, daemon=True).start()
+            self._schedule_discovery()
         else:
             _LOGGER.error(f"Failed to connect to MQTT broker, return code {rc}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """Callback for MQTT disconnection"""
         self.connected = False
-        self.discovery_sent = False
+        # Make sure the full state is sent as soon as we reconnect
+        self._last_state = {}
+        self._last_state_info = None
         if rc != 0:
             _LOGGER.warning("Unexpected MQTT disconnection")
         else:
@@ -119,47 +461,33 @@ class homeassistantClassPlugin(PluginSuperClass):
         if not self.connected:
             return
         
-        device_id = self.get_config("device_id")
-        command_topics = [
-            f"openeo/{device_id}/command/switch/set",
-            f"openeo/{device_id}/command/current_limit/set",
-            f"openeo/{device_id}/command/mode/set",
-            f"openeo/{device_id}/command/enable_plugin/set",
-            f"openeo/{device_id}/command/schedule_start/set",
-            f"openeo/{device_id}/command/schedule_end/set",
-            f"openeo/{device_id}/command/schedule_amps/set"
-        ]
-        
-        for topic in command_topics:
+        # Only skip subscribing on later reconnects if every subscription was accepted
+        all_subscribed = True
+        for topic in self._command_handlers:
             try:
-                self.mqtt_client.subscribe(topic)
-                _LOGGER.info(f"Subscribed to command topic: {topic}")
+                rc, mid = self.mqtt_client.subscribe(topic)
+                if rc == mqtt.MQTT_ERR_SUCCESS:
+                    _LOGGER.info(f"Subscribed to command topic: {topic}")
+                else:
+                    all_subscribed = False
+                    _LOGGER.error(f"Failed to subscribe to {topic}: return code {rc}")
             except Exception as e:
+                all_subscribed = False
                 _LOGGER.error(f"Failed to subscribe to {topic}: {e}")
+        
+        self._subscribed = all_subscribed
     
     def _on_message(self, client, userdata, msg):
         """Handle incoming MQTT command messages"""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8').strip()
-            device_id = self.get_config("device_id")
+            payload = msg.payload.strip()
             
-            _LOGGER.info(f"Received command on {topic}: {payload}")
+            _LOGGER.info(f"Received command on {topic}: {payload!r}")
             
-            if topic == f"openeo/{device_id}/command/switch/set":
-                self._handle_switch_command(payload)
-            elif topic == f"openeo/{device_id}/command/current_limit/set":
-                self._handle_current_limit_command(payload)
-            elif topic == f"openeo/{device_id}/command/mode/set":
-                self._handle_mode_command(payload)
-            elif topic == f"openeo/{device_id}/command/enable_plugin/set":
-                self._handle_enable_plugin_command(payload)
-            elif topic == f"openeo/{device_id}/command/schedule_start/set":
-                self._handle_schedule_start_command(payload)
-            elif topic == f"openeo/{device_id}/command/schedule_end/set":
-                self._handle_schedule_end_command(payload)
-            elif topic == f"openeo/{device_id}/command/schedule_amps/set":
-                self._handle_schedule_amps_command(payload)
+            handler = self._command_handlers.get(topic)
+            if handler:
+                handler(payload)
             else:
                 _LOGGER.warning(f"Unknown command topic: {topic}")
                 
@@ -170,7 +498,7 @@ class homeassistantClassPlugin(PluginSuperClass):
         """Handle switch on/off commands"""
         try:
             # Parse command - expect "ON" or "OFF"
-            switch_on = payload.upper() in ["ON", "TRUE", "1"]
+            switch_on = payload.upper() in self._TRUE_PAYLOADS
             
             # Enable switch plugin and set state
             globalState.configDB.set("switch", "enabled", True)
@@ -182,7 +510,7 @@ class homeassistantClassPlugin(PluginSuperClass):
             _LOGGER.info(f"Switch command executed: {switch_on}")
             
         except Exception as e:
-            _LOGGER.error(f"Error handling switch command '{payload}': {e}")
+            _LOGGER.error(f"Error handling switch command {payload!r}: {e}")
     
     def _handle_current_limit_command(self, payload):
         """Handle current limit commands"""
@@ -208,9 +536,9 @@ class homeassistantClassPlugin(PluginSuperClass):
             _LOGGER.info(f"Current limit set to {current_limit}A")
             
         except (ValueError, TypeError) as e:
-            _LOGGER.error(f"Invalid current limit value '{payload}': {e}")
+            _LOGGER.error(f"Invalid current limit value {payload!r}: {e}")
         except Exception as e:
-            _LOGGER.error(f"Error handling current limit command '{payload}': {e}")
+            _LOGGER.error(f"Error handling current limit command {payload!r}: {e}")
     
     def _handle_mode_command(self, payload):
         """Handle mode change commands using existing plugin system"""
@@ -218,49 +546,49 @@ class homeassistantClassPlugin(PluginSuperClass):
             mode = payload.lower()
             
             # Use existing plugin configuration system
-            if mode == "manual":
+            if mode == b"manual":
                 globalState.configDB.set("switch", "enabled", True)
                 globalState.configDB.set("scheduler", "enabled", False)
                 _LOGGER.info("Switched to manual mode")
                 
-            elif mode == "schedule":
+            elif mode == b"schedule":
                 globalState.configDB.set("scheduler", "enabled", True)
                 globalState.configDB.set("switch", "enabled", False)
                 _LOGGER.info("Switched to schedule mode")
                 
-            elif mode == "off":
+            elif mode == b"off":
                 globalState.configDB.set("scheduler", "enabled", False)
                 globalState.configDB.set("switch", "enabled", False)
                 _LOGGER.info("All charging modes disabled")
                 
             else:
-                _LOGGER.error(f"Unknown mode '{mode}'. Valid modes: manual, schedule, off")
+                _LOGGER.error(f"Unknown mode {mode!r}. Valid modes: manual, schedule, off")
                 
         except Exception as e:
-            _LOGGER.error(f"Error handling mode command '{payload}': {e}")
+            _LOGGER.error(f"Error handling mode command {payload!r}: {e}")
     
     def _handle_enable_plugin_command(self, payload):
         """Handle plugin enable/disable commands"""
         try:
             # Expected format: "plugin_name:enabled" e.g. "scheduler:true"
-            if ":" not in payload:
-                _LOGGER.error(f"Invalid plugin command format '{payload}'. Expected 'plugin:true/false'")
+            if b":" not in payload:
+                _LOGGER.error(f"Invalid plugin command format {payload!r}. Expected 'plugin:true/false'")
                 return
                 
-            plugin_name, enabled_str = payload.split(":", 1)
-            enabled = enabled_str.lower() in ["true", "on", "1", "enabled"]
+            plugin_name, enabled_str = payload.split(b":", 1)
+            enabled = enabled_str.lower() in self._PLUGIN_ENABLE_PAYLOADS
             
             # Validate plugin name (basic security)
-            valid_plugins = ["scheduler", "switch", "loadmanagement"]
-            if plugin_name not in valid_plugins:
-                _LOGGER.error(f"Plugin '{plugin_name}' not allowed for remote control")
+            if plugin_name not in self._REMOTE_PLUGINS:
+                _LOGGER.error(f"Plugin {plugin_name!r} not allowed for remote control")
                 return
             
+            plugin_name = plugin_name.decode()
             globalState.configDB.set(plugin_name, "enabled", enabled)
             _LOGGER.info(f"Plugin '{plugin_name}' {'enabled' if enabled else 'disabled'}")
             
         except Exception as e:
-            _LOGGER.error(f"Error handling plugin command '{payload}': {e}")
+            _LOGGER.error(f"Error handling plugin command {payload!r}: {e}")
     
     def _handle_schedule_start_command(self, payload):
         """Handle schedule start time command"""
@@ -270,7 +598,7 @@ class homeassistantClassPlugin(PluginSuperClass):
                 self._update_schedule_field("start", start_time)
                 _LOGGER.info(f"Schedule start time set to {start_time}")
         except Exception as e:
-            _LOGGER.error(f"Error handling schedule start command '{payload}': {e}")
+            _LOGGER.error(f"Error handling schedule start command {payload!r}: {e}")
     
     def _handle_schedule_end_command(self, payload):
         """Handle schedule end time command"""
@@ -280,7 +608,7 @@ class homeassistantClassPlugin(PluginSuperClass):
                 self._update_schedule_field("end", end_time)
                 _LOGGER.info(f"Schedule end time set to {end_time}")
         except Exception as e:
-            _LOGGER.error(f"Error handling schedule end command '{payload}': {e}")
+            _LOGGER.error(f"Error handling schedule end command {payload!r}: {e}")
     
     def _handle_schedule_amps_command(self, payload):
         """Handle schedule current limit command"""
@@ -296,20 +624,20 @@ class homeassistantClassPlugin(PluginSuperClass):
                 _LOGGER.error(f"Invalid schedule current limit: {current_limit}. Must be {globalState.MIN_CHARGING_CURRENT}-{max_allowed} amps")
                 
         except (ValueError, TypeError):
-            _LOGGER.error(f"Invalid schedule current limit value '{payload}'")
+            _LOGGER.error(f"Invalid schedule current limit value {payload!r}")
         except Exception as e:
-            _LOGGER.error(f"Error handling schedule amps command '{payload}': {e}")
+            _LOGGER.error(f"Error handling schedule amps command {payload!r}: {e}")
     
-    def _normalize_time(self, time_str):
-        """Convert time to HHMM format with basic validation"""
-        time_str = time_str.strip().replace(':', '')
+    def _normalize_time(self, time_bytes):
+        """Convert a bytes time payload to a HHMM format string with basic validation"""
+        time_bytes = time_bytes.strip().replace(b':', b'')
         
-        if len(time_str) == 4 and time_str.isdigit():
-            hour, minute = int(time_str[:2]), int(time_str[2:])
+        if len(time_bytes) == 4 and time_bytes.isdigit():
+            hour, minute = int(time_bytes[:2]), int(time_bytes[2:])
             if 0 <= hour <= 23 and 0 <= minute <= 59:
-                return time_str
+                return time_bytes.decode()
         
-        _LOGGER.error(f"Invalid time format '{time_str}'. Expected HH:MM or HHMM")
+        _LOGGER.error(f"Invalid time format {time_bytes!r}. Expected HH:MM or HHMM")
         return None
     
     def _update_schedule_field(self, field, value):
@@ -388,326 +716,221 @@ class homeassistantClassPlugin(PluginSuperClass):
     def _get_device_info(self):
         """Generate device information for Home Assistant"""
         return {
-            "identifiers": [self.get_config("device_id")],
+            "identifiers": [self._device_id],
             "name": self.get_config("device_name"),
             "manufacturer": "OpenEO",
             "model": "EV Charger Controller",
             "sw_version": globalState.stateDict.get("app_version", "unknown")
         }
     
+    def _schedule_discovery(self):
+        """Queue a discovery run on the worker thread. If one is already running, ask it to run again
+        once finished, as a reconnect may have happened part way through"""
+        with self._discovery_lock:
+            if self._discovery_running:
+                self._discovery_rerun = True
+                return
+            self._discovery_running = True
+        
+        try:
+            self._discovery_pool.submit(self._run_discovery_safe)
+        except Exception as e:
+            with self._discovery_lock:
+                self._discovery_running = False
+            _LOGGER.error(f"Failed to schedule discovery: {e}")
+    
+    def _run_discovery_safe(self):
+        """Worker wrapper for _send_discovery, repeating it while reruns are requested"""
+        while True:
+            try:
+                self._send_discovery()
+            except Exception as e:
+                _LOGGER.error(f"Error sending discovery messages: {e}")
+            
+            # Checked and cleared under the lock, so a request can't slip in between deciding to stop and stopping
+            with self._discovery_lock:
+                if not self._discovery_rerun:
+                    self._discovery_running = False
+                    return
+                self._discovery_rerun = False
+    
     def _send_discovery(self):
         """Send Home Assistant auto-discovery messages"""
         if not self.connected:
             return
         
-        device_info = self._get_device_info()
-        discovery_prefix = self.get_config("mqtt_discovery_prefix")
-        device_id = self.get_config("device_id")
-        
-        # Define all sensors to create in Home Assistant
-        sensors = [
-            {
-                "component": "sensor",
-                "object_id": "charger_state",
-                "name": "Charger State",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.charger_state }}",
-                "icon": "mdi:ev-station"
-            },
-            {
-                "component": "sensor", 
-                "object_id": "amps_requested",
-                "name": "Amps Requested",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.amps_requested }}",
-                "unit_of_measurement": "A",
-                "device_class": "current",
-                "icon": "mdi:current-ac"
-            },
-            {
-                "component": "sensor",
-                "object_id": "amps_limit", 
-                "name": "Amps Limit",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.amps_limit }}",
-                "unit_of_measurement": "A", 
-                "device_class": "current",
-                "icon": "mdi:current-ac"
-            },
-            {
-                "component": "sensor",
-                "object_id": "power_delivered",
-                "name": "Power Delivered", 
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.power_delivered }}",
-                "unit_of_measurement": "kW",
-                "device_class": "power",
-                "icon": "mdi:flash"
-            },
-            {
-                "component": "sensor",
-                "object_id": "power_requested",
-                "name": "Power Requested",
-                "state_topic": f"openeo/{device_id}/state", 
-                "value_template": "{{ value_json.power_requested }}",
-                "unit_of_measurement": "kW",
-                "device_class": "power",
-                "icon": "mdi:flash-outline"
-            },
-            {
-                "component": "sensor",
-                "object_id": "voltage",
-                "name": "Voltage",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.voltage }}",
-                "unit_of_measurement": "V",
-                "device_class": "voltage", 
-                "icon": "mdi:lightning-bolt"
-            },
-            {
-                "component": "sensor",
-                "object_id": "frequency",
-                "name": "Mains Frequency",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.frequency }}",
-                "unit_of_measurement": "Hz",
-                "device_class": "frequency",
-                "icon": "mdi:sine-wave"
-            },
-            {
-                "component": "sensor",
-                "object_id": "current_site",
-                "name": "Site Current", 
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.current_site }}",
-                "unit_of_measurement": "A",
-                "device_class": "current",
-                "icon": "mdi:home-lightning-bolt"
-            },
-            {
-                "component": "sensor",
-                "object_id": "current_vehicle",
-                "name": "Vehicle Current",
-                "state_topic": f"openeo/{device_id}/state", 
-                "value_template": "{{ value_json.current_vehicle }}",
-                "unit_of_measurement": "A",
-                "device_class": "current",
-                "icon": "mdi:car-electric"
-            },
-            {
-                "component": "sensor", 
-                "object_id": "current_solar",
-                "name": "Solar Current",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.current_solar }}",
-                "unit_of_measurement": "A",
-                "device_class": "current", 
-                "icon": "mdi:solar-power"
-            },
-            {
-                "component": "binary_sensor",
-                "object_id": "vehicle_connected",
-                "name": "Vehicle Connected",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.vehicle_connected }}",
-                "payload_on": "true",
-                "payload_off": "false",
-                "device_class": "connectivity",
-                "icon": "mdi:car-connected"
-            },
-            {
-                "component": "binary_sensor",
-                "object_id": "charging_active", 
-                "name": "Charging Active",
-                "state_topic": f"openeo/{device_id}/state",
-                "value_template": "{{ value_json.charging_active }}",
-                "payload_on": "true",
-                "payload_off": "false",
-                "device_class": "battery_charging",
-                "icon": "mdi:battery-charging"
-            }
-        ]
+        discovery_prefix = self._discovery_prefix
+        device_id = self._device_id
+        sd_get = globalState.stateDict.get
         
         # Get dynamic current limits
         max_allowed_current = min(globalState.MAX_CHARGING_CURRENT, 
-                                globalState.stateDict.get("eo_overall_limit_current", globalState.MAX_CHARGING_CURRENT))
-        
-        # Define control entities for Home Assistant
-        control_entities = [
-            {
-                "component": "switch",
-                "object_id": "charger_switch",
-                "name": "Charger Switch",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/switch/set",
-                "value_template": "{{ 'ON' if (value_json.switch_enabled and value_json.switch_on) else 'OFF' }}",
-                "payload_on": "ON",
-                "payload_off": "OFF",
-                "icon": "mdi:ev-station",
-                "device_class": "switch"
-            },
-            {
-                "component": "number",
-                "object_id": "current_limit",
-                "name": "Current Limit",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/current_limit/set",
-                "value_template": "{{ value_json.current_limit_setting }}",
-                "min": globalState.MIN_CHARGING_CURRENT,
-                "max": max_allowed_current,
-                "step": 1,
-                "unit_of_measurement": "A",
-                "device_class": "current",
-                "icon": "mdi:current-ac"
-            },
-            {
-                "component": "select",
-                "object_id": "charger_mode",
-                "name": "Charger Mode",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/mode/set",
-                "value_template": "{{ 'manual' if value_json.mode == 'manual' else ('schedule' if value_json.mode == 'schedule' else 'off') }}",
-                "options": ["manual", "schedule", "off"],
-                "icon": "mdi:cog"
-            },
-            {
-                "component": "time",
-                "object_id": "schedule_start",
-                "name": "Schedule Start Time",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/schedule_start/set",
-                "value_template": "{{ value_json.schedule_start[:2] + ':' + value_json.schedule_start[2:] if value_json.schedule_start and value_json.schedule_start|length == 4 else '22:00' }}",
-                "icon": "mdi:clock-start"
-            },
-            {
-                "component": "time",
-                "object_id": "schedule_end",
-                "name": "Schedule End Time",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/schedule_end/set",
-                "value_template": "{{ value_json.schedule_end[:2] + ':' + value_json.schedule_end[2:] if value_json.schedule_end and value_json.schedule_end|length == 4 else '06:00' }}",
-                "icon": "mdi:clock-end"
-            },
-            {
-                "component": "number",
-                "object_id": "schedule_amps",
-                "name": "Schedule Current Limit",
-                "state_topic": f"openeo/{device_id}/state",
-                "command_topic": f"openeo/{device_id}/command/schedule_amps/set",
-                "value_template": "{{ value_json.schedule_amps }}",
-                "min": globalState.MIN_CHARGING_CURRENT,
-                "max": max_allowed_current,
-                "step": 1,
-                "unit_of_measurement": "A",
-                "device_class": "current",
-                "icon": "mdi:current-ac"
-            }
-        ]
+                                sd_get("eo_overall_limit_current", globalState.MAX_CHARGING_CURRENT))
         
-        # Combine sensors and control entities for discovery
-        all_entities = sensors + control_entities
+        # The discovery payloads only depend on these values, so only rebuild them if one has changed
+        cache_key = (device_id, self.get_config("device_name"), discovery_prefix, max_allowed_current,
+                     sd_get("app_version", "unknown"))
+        if self._discovery_cache is None or self._discovery_cache[0] != cache_key:
+            messages = self._build_discovery_messages(device_id, discovery_prefix, max_allowed_current)
+            digest = hashlib.sha1(b"".join(topic.encode() + payload for topic, payload in messages)).hexdigest()
+            self._discovery_cache = (cache_key, messages, digest)
+        
+        # Discovery messages are retained, so there is no need to resend them if they haven't changed
+        digest = self._discovery_cache[2]
+        with self._discovery_hash_lock:
+            last_sent_hash = self._last_sent_hash
+            generation = self._discovery_hash_generation
+        if digest == last_sent_hash:
+            _LOGGER.debug("Home Assistant discovery messages unchanged - not resending")
+            return
         
         # Send discovery message for each entity
-        for entity in all_entities:
-            config = {
-                "name": entity["name"],
-                "unique_id": f"{device_id}_{entity['object_id']}",
-                "state_topic": entity["state_topic"],
-                "device": device_info
-            }
-            
-            # Add optional fields if present
-            for field in ["value_template", "unit_of_measurement", "device_class", 
-                         "icon", "payload_on", "payload_off", "command_topic", "min", "max", "step", "options"]:
-                if field in entity:
-                    config[field] = entity[field]
-            
-            topic = f"{discovery_prefix}/{entity['component']}/{device_id}/{entity['object_id']}/config"
-            payload = json.dumps(config)
-            
+        publish = self.mqtt_client.publish
+        all_sent = True
+        for topic, payload in self._discovery_cache[1]:
             try:
-                self.mqtt_client.publish(topic, payload, retain=True)
-                _LOGGER.debug(f"Published discovery for {entity['name']}")
+                if publish(topic, payload, qos=1, retain=True).rc != mqtt.MQTT_ERR_SUCCESS:
+                    all_sent = False
+                _LOGGER.debug(f"Published discovery to {topic}")
             except Exception as e:
-                _LOGGER.error(f"Failed to publish discovery for {entity['name']}: {e}")
+                all_sent = False
+                _LOGGER.error(f"Failed to publish discovery to {topic}: {e}")
         
-        self.discovery_sent = True
+        if all_sent:
+            self._save_discovery_hash(digest, generation)
         _LOGGER.info("Home Assistant discovery messages sent")
     
-    def _publish_state(self):
-        """Publish current state to MQTT"""
+    def _load_discovery_hash(self):
+        """Read the hash of the last sent discovery messages, if any"""
+        try:
+            with open(self._discovery_hash_file, "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+    
+    def _save_discovery_hash(self, digest, generation):
+        """Record the hash of the discovery messages that have just been sent, unless the
+        broker's retained state was invalidated while they were being sent"""
+        with self._discovery_hash_lock:
+            if generation != self._discovery_hash_generation:
+                _LOGGER.debug("Discovery hash invalidated during send - not recording")
+                return
+            self._last_sent_hash = digest
+            try:
+                with open(self._discovery_hash_file, "w") as f:
+                    f.write(digest)
+            except OSError as e:
+                _LOGGER.warning(f"Unable to save discovery hash to {self._discovery_hash_file}: {e}")
+    
+    def _build_discovery_messages(self, device_id, discovery_prefix, max_allowed_current):
+        """Build the (topic, payload) list of Home Assistant auto-discovery messages"""
+        device_info = self._get_device_info()
+        
+        messages = []
+        for entity in _DISCOVERY_ENTITIES:
+            # Entities hold exactly the fields HA needs, apart from component and object_id which form the topic
+            config = {key: value.replace("{device_id}", device_id) if isinstance(value, str) else value
+                      for key, value in entity.items()}
+            config["unique_id"] = f"{device_id}_{entity['object_id']}"
+            config["availability_topic"] = f"openeo/{device_id}/availability"
+            config["device"] = device_info
+            if "max" in config:
+                config["max"] = max_allowed_current
+            component = config.pop("component")
+            object_id = config.pop("object_id")
+            
+            topic = f"{discovery_prefix}/{component}/{device_id}/{object_id}/config"
+            messages.append((topic, _dumps(config)))
+        
+        return messages
+    
+    def _publish_state(self, wall_now, now_mono):
+        """Publish current state to MQTT (wall and monotonic times are supplied by poll())"""
         if not self.connected:
             return
         
-        # Determine vehicle connection and charging status from charger state
-        charger_state = globalState.stateDict.get("eo_charger_state", "")
-        charger_state_id = globalState.stateDict.get("eo_charger_state_id", 0)
+        # paho doesn't limit its queue of QoS 0 packets, so if the previous tick's state hasn't been
+        # written out yet (e.g. the broker is stuck), skip this tick rather than queue more behind it.
+        # Skipped changes are still unpublished in _last_state, so they go out on a later tick.
+        generation = self._connection_generation
+        last_state_info = self._last_state_info
+        if last_state_info is not None and last_state_info[0] == generation and not last_state_info[1].is_published():
+            _LOGGER.debug("Previous state still queued - skipping state publish")
+            return
         
-        # Vehicle is connected if state indicates plug present, car connected, or charging
-        vehicle_connected = charger_state_id in [7, 8, 9, 10, 11, 12, 13, 14, 15, 16]  # Based on CHARGER_STATES from openeoCharger.py
+        # Bind frequently used lookups as locals
+        sd_get = globalState.stateDict.get
+        cfg_get = globalState.configDB.get
         
-        # Charging is active if in charging or charge-complete states
-        charging_active = charger_state_id in [11, 12, 13, 14]
+        # Copy the raw charger values straight out of the state dict. Only values that a discovered
+        # entity reads are published.
+        state_payload = {key: sd_get(state_key, default) for key, state_key, default in self._STATE_MAP}
+        charger_state_bit = 1 << sd_get("eo_charger_state_id", 0)
         
-        # Determine current operating mode
-        current_mode = self._get_current_mode()
+        # Determine vehicle connection and charging status from charger state
+        vehicle_connected = charger_state_bit & self._VEHICLE_CONNECTED_MASK
+        charging_active = charger_state_bit & self._CHARGING_ACTIVE_MASK
         
-        state_payload = {
-            "charger_state": charger_state,
-            "charger_state_id": charger_state_id,
-            "amps_requested": globalState.stateDict.get("eo_amps_requested", 0),
-            "amps_limit": globalState.stateDict.get("eo_amps_limit", 0),
-            "power_delivered": globalState.stateDict.get("eo_power_delivered", 0),
-            "power_requested": globalState.stateDict.get("eo_power_requested", 0),
-            "voltage": globalState.stateDict.get("eo_live_voltage", 0),
-            "frequency": globalState.stateDict.get("eo_mains_frequency", 0),
-            "current_site": globalState.stateDict.get("eo_current_site", 0),
-            "current_vehicle": globalState.stateDict.get("eo_current_vehicle", 0),
-            "current_solar": globalState.stateDict.get("eo_current_solar", 0),
-            "vehicle_connected": "true" if vehicle_connected else "false",
-            "charging_active": "true" if charging_active else "false",
-            "mode": current_mode,
-            "switch_on": globalState.configDB.get("switch", "on", False),
-            "switch_enabled": globalState.configDB.get("switch", "enabled", False),
-            "current_limit_setting": self._get_current_limit_setting(),
-            "schedule_start": self._get_schedule_field("start"),
-            "schedule_end": self._get_schedule_field("end"),
-            "schedule_amps": self._get_schedule_field("amps"),
-            "serial_errors": globalState.stateDict.get("eo_serial_errors", 0),
-            "app_version": globalState.stateDict.get("app_version", "unknown"),
-            "timestamp": int(time.time())
-        }
+        # Add the derived values
+        state_payload["vehicle_connected"] = "true" if vehicle_connected else "false"
+        state_payload["charging_active"] = "true" if charging_active else "false"
+        state_payload["mode"] = self._get_current_mode()
+        state_payload["switch"] = "ON" if (cfg_get("switch", "enabled", False) and cfg_get("switch", "on", False)) else "OFF"
+        state_payload["current_limit_setting"] = self._get_current_limit_setting()
+        state_payload["schedule_start"] = self._get_schedule_field("start")
+        state_payload["schedule_end"] = self._get_schedule_field("end")
+        state_payload["schedule_amps"] = self._get_schedule_field("amps")
         
-        device_id = self.get_config("device_id")
-        topic = f"openeo/{device_id}/state"
-        payload = json.dumps(state_payload)
+        # Each field is published to its own topic, and only when it has changed since it was last
+        # sent - unless the heartbeat is due, in which case everything is republished. State is not
+        # retained, so the heartbeat is also what brings a newly (re)started subscriber up to date.
+        if now_mono - self._last_heartbeat >= self.HEARTBEAT_INTERVAL:
+            self._last_state = {}
+            self._last_heartbeat = now_mono
         
-        try:
-            self.mqtt_client.publish(topic, payload)
-            _LOGGER.debug("Published state to MQTT")
-        except Exception as e:
-            _LOGGER.error(f"Failed to publish state: {e}")
+        last_state = self._last_state
+        changed = {key: value for key, value in state_payload.items() if last_state.get(key, _MISSING) != value}
+        if not changed:
+            return
+        # The timestamp is only sent with a full republish (heartbeat or reconnect), so that a
+        # single changed value costs a single message
+        if "timestamp" not in last_state:
+            changed["timestamp"] = wall_now
+        
+        publish = self.mqtt_client.publish
+        base_topic = self._state_topic
+        for key, value in changed.items():
+            try:
+                info = publish(f"{base_topic}/{key}", str(value), qos=0, retain=False)
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    # Packets are written in order, so the last one tells us when the whole tick has gone out
+                    self._last_state_info = (generation, info)
+                    last_state[key] = value
+            except Exception as e:
+                _LOGGER.error(f"Failed to publish state {key}: {e}")
+        _LOGGER.debug(f"Published {len(changed)} state value(s) to MQTT")
     
     def poll(self):
         """Called by main loop - publish state at configured interval"""
-        if not MQTT_AVAILABLE or not self.get_config("enabled"):
+        if not MQTT_AVAILABLE or not self._enabled:
             return 0
         
-        current_time = time.time()
-        publish_interval = self.get_config("publish_interval")
-        
-        # Send discovery messages if not sent yet and connected
-        if self.connected and not self.discovery_sent:
-            threading.Thread(target=self._send_discovery, daemon=True).start()
+        # Monotonic clock for interval scheduling, so that wall-clock (NTP) adjustments don't affect it
+        now_mono = time.monotonic()
         
         # Publish state at configured interval
-        if current_time - self.last_publish >= publish_interval:
-            self._publish_state()
-            self.last_publish = current_time
+        if now_mono - self.last_publish >= self._publish_interval:
+            self._publish_state(int(time.time()), now_mono)
+            self.last_publish = now_mono
         
         # Return 0 - this plugin doesn't control charging
         return 0
     
+    def close(self):
+        """Disconnect from the MQTT broker and stop background threads. Called when the plugin is unloaded"""
+        if self._finalizer:
+            self._finalizer()
+    
     def get_user_settings(self):
         """Return configuration options for web interface"""
         return [
@@ -721,9 +944,3 @@ class homeassistantClassPlugin(PluginSuperClass):
             {"key": "device_id", "type": "str", "title": "Device ID"},
             {"key": "publish_interval", "type": "int", "title": "Publish Interval (seconds)"}
         ]
-    
-    def __del__(self):
-        """Cleanup MQTT connection on plugin destruction"""
-        if self.mqtt_client and self.connected:
-            self.mqtt_client.loop_stop()
-            self.mqtt_client.disconnect()
\ No newline at end of file
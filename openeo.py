@@ -105,6 +105,8 @@ def main():
                 if not modulename in globalState.configDB.dict().keys():
                     # module has recently been disabled in configfile, so unload
                     _LOGGER.info("Unloading %s",modulename)
+                    if callable(getattr(module,"close",None)):
+                        module.close()
                     del globalState.stateDict["_moduleDict"][modulename]
 
         # Take any action necessary - the module poll() function should return a numeric value
@@ -33,7 +33,7 @@ fi
 
 # Install prereq packages
 sudo apt-get update
-sudo apt-get install -y python3-serial python3-websockets python3-jsonschema python3-jinja2 python3-psutil python3-paho-mqtt dnsmasq nginx fcgiwrap spawn-fcgi iptables at
+sudo apt-get install -y python3-serial python3-websockets python3-jsonschema python3-jinja2 python3-psutil python3-paho-mqtt python3-orjson dnsmasq nginx fcgiwrap spawn-fcgi iptables at
 
 if [ $? -ne 0 ] ; then
 	echo >&2 "ERROR: Package Install failed - Deploy Aborted"